@@ -1,167 +1,811 @@
 import os
 import yaml
-import requests
-import json
+import httpx
+import orjson
+import asyncio
+import re
+import random
 import datetime
 import time
 import uuid
-from typing import List, Dict, Any, Optional
-from openai import OpenAI
+import io
+import functools
+import logging
+import collections
+import hashlib
+import sqlite3
+import urllib.parse
+from typing import List, Dict, Any, Optional, Tuple
+
+try:
+    from yaml import CSafeLoader as SafeLoader, CSafeDumper as SafeDumper
+except ImportError:
+    from yaml import SafeLoader, SafeDumper
+
+logger = logging.getLogger(__name__)
+
+# config_path -> (mtime_ns, config), so an untouched apps.yaml is parsed once per process
+_CONFIG_CACHE: Dict[str, Tuple[int, Dict]] = {}
+
+HTTP_RETRIES = 3
+HTTP_BACKOFF = 0.5
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Longest we will sleep for a Retry-After or a GitHub rate-limit reset
+MAX_RETRY_WAIT = 60
+# Hold GitHub calls until the reset once fewer than this many requests remain
+RATE_LIMIT_FLOOR = 5
+
+ETAG_CACHE_PATH = "etag_cache.json"
+UPDATE_OFFSET_PATH = "telegram_offset.json"
+UPDATE_WORKERS = 8
+POLL_BACKOFF_MAX = 30  # seconds between getUpdates retries while Telegram keeps failing
+ANALYSIS_CACHE_PATH = "supervisor_cache.db"
+ANALYSIS_CACHE_TTL = 7 * 24 * 3600
+GRAPHQL_URL = "https://api.github.com/graphql"
+GRAPHQL_BATCH_SIZE = 50
+# Check suites created by GitHub Actions belong to this GitHub App
+GITHUB_ACTIONS_APP_ID = 15368
+LATEST_RUN_FRAGMENT = """
+fragment LatestRun on Repository {
+  defaultBranchRef {
+    target {
+      ... on Commit {
+        checkSuites(last: 1, filterBy: {appId: %d}) {
+          nodes { status conclusion workflowRun { databaseId workflow { name } } }
+        }
+      }
+    }
+  }
+}
+""" % GITHUB_ACTIONS_APP_ID
+
+FIX_LABELS = ("retry_workflow", "reinstall_dependencies", "clear_cache", "delay_quota_reset", "none")
+# Ordered rules mapping a failed run's title to a fix; the LLM only sees what none of them match
+CLASSIFIER = [
+    (re.compile(r"quota|rate.?limit", re.I), "delay_quota_reset"),
+    (re.compile(r"npm|pip|module not found|ModuleNotFoundError|ImportError", re.I), "reinstall_dependencies"),
+    (re.compile(r"cache", re.I), "clear_cache"),
+    (re.compile(r"timeout|timed out|network|ETIMEDOUT|ECONNRESET|502|503", re.I), "retry_workflow"),
+]
+RULE_CONFIDENCE = 90
+# Fixes safe to apply unattended; each one re-runs the failed jobs of the run
+SAFE_FIXES = {"retry_workflow", "reinstall_dependencies", "clear_cache"}
+AUTO_FIX_MIN_CONFIDENCE = 80
+ANALYSIS_PROMPT = (
+    "You triage failed GitHub Actions runs. The user sends {\"failures\": [{\"id\", \"ctx\"}]}. "
+    f"For each failure pick the safest fix from: {', '.join(FIX_LABELS)}. "
+    "Reply with JSON: {\"fixes\": {\"<id>\": {\"fix\": \"<label>\", \"confidence\": <0-100>, \"reason\": \"<short>\"}}}"
+)
+
+# Identical bytes on every chat request, so the provider can reuse the cached prompt prefix
+SYSTEM_HEADER = "You are Shisui, a smart assistant. Help the user with the GitHub-hosted bots listed below."
+
+ADD_BOT_PREFIX = "Add new Telegram bot:"
+
+# Report blocks, filled in per bot by _check_bot
+OK_TMPL = "🟢 {name} ({channel})\n   ✔ Status: Success\n   ℹ Notes: {notes}"
+PENDING_TMPL = "🟡 {name} ({channel})\n   ⏳ Status: {status}"
+FAILED_TMPL = "🔴 {name} ({channel})\n   ❌ Status: Failed\n   ⚠ Error: {error}"
+FIX_LINE = "\n   🤖 Suggested Fix: {fix}"
+AUTO_FIX_LINE = "\n   ⚙ Auto-Fix: Failed jobs re-run"
+
+BASE_HEADERS = {"User-Agent": "Supervisor-Bot"}
+GITHUB_HEADERS = {"Accept": "application/vnd.github.v3+json"}
+_ADD_RE = re.compile(
+    r"^Add new Telegram bot:\s*(?P<url>https://github\.com/[^\s,/]+/[^\s,]+)\s*,\s*(?P<acc>[^\s,]+)\s*,\s*(?P<channel>\S+)\s*$"
+)
+
+TELEGRAM_CHUNK_SIZE = 4000  # sendMessage rejects texts over 4096 characters
+
+
+def split_message(text: str, limit: int = TELEGRAM_CHUNK_SIZE) -> List[str]:
+    """Splits text into chunks of at most `limit` characters, preferring newline boundaries."""
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = limit
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    chunks.append(text)
+    return chunks
+
+
+@functools.lru_cache(maxsize=None)
+def _pat_for(account_key: str) -> Optional[str]:
+    """Resolves PAT_<ACCOUNT> once per account; the environment does not change mid-run."""
+    env_var = f"PAT_{account_key.upper()}"
+    pat = os.getenv(env_var)
+    logger.debug("PAT for %s (%s): %s", account_key, env_var, "Found" if pat else "Not Found")
+    return pat
+
+
+@functools.lru_cache(maxsize=None)
+def _headers_for(pat: str) -> Dict[str, str]:
+    """One shared GitHub header dict per PAT; callers must copy it before adding headers."""
+    return {**GITHUB_HEADERS, "Authorization": f"token {pat}"}
+
+
+# Read-only per-run view of a configured bot; headers is None when the account has no PAT
+Bot = collections.namedtuple("Bot", "name repo acc channel owner_repo runs_url rerun_url_tmpl headers")
+
+# Triage verdict for one failure; the defaults double as the "could not classify" answer
+FixResult = collections.namedtuple("FixResult", "fix confidence reason", defaults=("none", 0, ""))
+UNCLASSIFIED = FixResult(reason="unclassified")
+
+
+def _fix_result(data: Any) -> FixResult:
+    """Validates one LLM answer, falling back to UNCLASSIFIED for anything malformed."""
+    if not isinstance(data, dict) or data.get("fix") not in FIX_LABELS:
+        return UNCLASSIFIED
+    confidence = data.get("confidence", 0)
+    if not isinstance(confidence, (int, float)):
+        confidence = 0
+    return FixResult(data["fix"], int(confidence), str(data.get("reason", "")))
+
+
+def _owner_repo(repo_url: str) -> Tuple[str, str]:
+    """Splits a GitHub repo URL into (owner, repo); raises ValueError if either part is missing."""
+    owner, repo = urllib.parse.urlparse(repo_url).path.strip("/").removesuffix(".git").split("/")[:2]
+    if not owner or not repo:
+        raise ValueError(f"no owner/repo in {repo_url!r}")
+    return owner, repo
+
+
+def _repo_key(repo_url: str) -> str:
+    """Case-insensitive "owner/repo", so URL variants of the same repo compare equal."""
+    return "/".join(_owner_repo(repo_url)).lower()
+
+
+def _analysis_key(error_context: str) -> str:
+    """Hash of the lowercased, whitespace-collapsed failure text, so trivially different titles share an entry."""
+    return hashlib.sha256(" ".join(error_context.lower().split()).encode()).hexdigest()
 
-# Initialize OpenAI client for Gemini
-client = OpenAI()
 
 class SupervisorBot:
     def __init__(self, config_path: str = "apps.yaml"):
         self.config_path = config_path
         self.config = self.load_config()
+        # Lowercased owner/repo -> bot dict, for O(1) duplicate checks when adding bots
+        self._bots_by_repo = {b["_owner_repo"].lower(): b for b in self.config.get("bots", []) if "_error" not in b}
         self.telegram_token = os.getenv("TELEGRAM_TOKEN")
         self.telegram_chat_id = os.getenv("TELEGRAM_CHAT_ID")
-        self.last_update_id = 0
-        print(f"DEBUG: Initialized. Token set: {bool(self.telegram_token)}, Chat ID: {self.telegram_chat_id}")
+        # Bot API endpoints, built once; requests go over the shared HTTP/2 client
+        self.telegram_api = f"https://api.telegram.org/bot{self.telegram_token}"
+        self.last_update_id = self.load_update_offset()
+        self.etag_cache = self.load_etag_cache()
+        # Updates are handled as background tasks so a slow LLM reply never delays the next poll
+        self._update_slots = asyncio.Semaphore(UPDATE_WORKERS)
+        self._update_tasks = set()
+        # (Authorization header, "graphql" or "core") -> last (X-RateLimit-Remaining, X-RateLimit-Reset).
+        # GitHub budgets each PAT's GraphQL and REST calls separately, so bots sharing a PAT back
+        # off together but a spent GraphQL budget never stalls the REST fallback
+        self._rate_limits: Dict[Tuple[str, str], Tuple[int, float]] = {}
+        self.cache_db = sqlite3.connect(ANALYSIS_CACHE_PATH)
+        self.cache_db.execute("CREATE TABLE IF NOT EXISTS analysis_cache (hash TEXT PRIMARY KEY, json TEXT, ts INTEGER)")
+        # Runs already re-run once; a run that fails again is left for a human instead of looping
+        self.cache_db.execute("CREATE TABLE IF NOT EXISTS auto_fixes (run_id INTEGER PRIMARY KEY, ts INTEGER)")
+        # One pooled HTTP/2 client shared by every GitHub and Telegram call; the
+        # transport also retries failed connection attempts
+        limits = httpx.Limits(max_connections=32, max_keepalive_connections=16)
+        self.http = httpx.AsyncClient(
+            # Fail fast on unreachable hosts; reads get the full 10s
+            timeout=httpx.Timeout(10.0, connect=3.0),
+            headers=BASE_HEADERS,
+            transport=httpx.AsyncHTTPTransport(http2=True, limits=limits, retries=HTTP_RETRIES),
+        )
+        logger.debug("Initialized. Token set: %s, Chat ID: %s", bool(self.telegram_token), self.telegram_chat_id)
         
+    @functools.cached_property
+    def _openai(self):
+        """OpenAI client for Gemini; imported and built on first use so healthy report-only runs skip it."""
+        from openai import AsyncOpenAI
+        return AsyncOpenAI()
+
+    async def close_openai(self):
+        if "_openai" in self.__dict__:
+            await self._openai.close()
+
     def load_config(self) -> Dict:
         if not os.path.exists(self.config_path):
-            print(f"DEBUG: Config file {self.config_path} not found.")
+            logger.warning("Config file %s not found.", self.config_path)
             return {"bots": []}
+        mtime = os.stat(self.config_path).st_mtime_ns
+        cached = _CONFIG_CACHE.get(self.config_path)
+        if cached and cached[0] == mtime:
+            return cached[1]
         with open(self.config_path, "r") as f:
-            config = yaml.safe_load(f) or {"bots": []}
-            print(f"DEBUG: Loaded {len(config.get('bots', []))} bots.")
-            return config
+            config = yaml.load(f, Loader=SafeLoader) or {"bots": []}
+            logger.debug("Loaded %d bots.", len(config.get("bots", [])))
+        for bot in config.get("bots", []):
+            try:
+                self._prepare_bot(bot)
+            except (KeyError, ValueError, TypeError, AttributeError) as e:
+                # One bad entry must not take the whole run down; it is reported as failed instead
+                logger.warning("Invalid bot entry %s: %r", bot.get("name"), e)
+                bot["_error"] = "Invalid repo_url in apps.yaml"
+        _CONFIG_CACHE[self.config_path] = (mtime, config)
+        return config
+
+    @staticmethod
+    def _prepare_bot(bot: Dict):
+        """Precomputes the per-repo strings and PAT headers the API calls need; keys starting with _ are never saved."""
+        owner, repo = _owner_repo(bot["repo_url"])
+        api_url = f"https://api.github.com/repos/{owner}/{repo}"
+        bot["_owner_repo"] = f"{owner}/{repo}"
+        bot["_runs_url"] = f"{api_url}/actions/runs?per_page=1"
+        bot["_rerun_url_tmpl"] = f"{api_url}/actions/runs/{{run_id}}/rerun-failed-jobs"
+        pat = _pat_for(bot["account"]) if bot.get("account") else None
+        bot["_headers"] = _headers_for(pat) if pat else None
 
     def save_config(self):
+        bots = [{k: v for k, v in bot.items() if not k.startswith("_")} for bot in self.config.get("bots", [])]
         with open(self.config_path, "w") as f:
-            yaml.dump(self.config, f)
+            yaml.dump({**self.config, "bots": bots}, f, Dumper=SafeDumper)
+        _CONFIG_CACHE[self.config_path] = (os.stat(self.config_path).st_mtime_ns, self.config)
+
+    def load_etag_cache(self) -> Dict:
+        """Maps repo_url -> [etag, last run, not_before] so unchanged repos can be polled conditionally."""
+        try:
+            with open(ETAG_CACHE_PATH, "rb") as f:
+                return orjson.loads(f.read())
+        except (OSError, ValueError):
+            return {}
+
+    def save_etag_cache(self):
+        with open(ETAG_CACHE_PATH, "wb") as f:
+            f.write(orjson.dumps(self.etag_cache))
+
+    def load_update_offset(self) -> int:
+        """Last acknowledged Telegram update_id, kept across runs so updates are never re-fetched."""
+        try:
+            with open(UPDATE_OFFSET_PATH, "rb") as f:
+                return int(orjson.loads(f.read()).get("last_update_id", 0))
+        except (OSError, ValueError, AttributeError):
+            return 0
+
+    def save_update_offset(self):
+        with open(UPDATE_OFFSET_PATH, "wb") as f:
+            f.write(orjson.dumps({"last_update_id": self.last_update_id}))
+
+    def get_cached_fix(self, key: str) -> Optional[FixResult]:
+        row = self.cache_db.execute(
+            "SELECT json FROM analysis_cache WHERE hash = ? AND ts > ?", (key, int(time.time()) - ANALYSIS_CACHE_TTL)
+        ).fetchone()
+        return _fix_result(orjson.loads(row[0])) if row else None
+
+    def cache_fixes(self, fixes: Dict[str, FixResult]):
+        now = int(time.time())
+        self.cache_db.executemany(
+            "INSERT OR REPLACE INTO analysis_cache (hash, json, ts) VALUES (?, ?, ?)",
+            [(key, orjson.dumps(result._asdict()), now) for key, result in fixes.items()]
+        )
+        self.cache_db.commit()
+
+    def reserve_fixes(self, run_ids: List[int]) -> set:
+        """Claims the runs no one has re-run yet and returns them.
+
+        Claiming happens before any rerun request is awaited, so concurrent monitoring
+        runs in this process can never both re-run the same run.
+        """
+        now = int(time.time())
+        claimed = {
+            run_id for run_id in run_ids
+            if self.cache_db.execute("INSERT OR IGNORE INTO auto_fixes (run_id, ts) VALUES (?, ?)", (run_id, now)).rowcount
+        }
+        self.cache_db.commit()
+        return claimed
+
+    def count_fixes_since(self, ts: int) -> int:
+        return self.cache_db.execute("SELECT COUNT(*) FROM auto_fixes WHERE ts >= ?", (ts,)).fetchone()[0]
+
+    def release_fixes(self, run_ids: List[int]):
+        """Drops claims whose rerun request failed, so a later run may try again."""
+        self.cache_db.executemany("DELETE FROM auto_fixes WHERE run_id = ?", [(run_id,) for run_id in run_ids])
+        self.cache_db.commit()
+
+    async def _request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """Sends a request on the pooled client, retrying rate limits and server errors.
+
+        Waits honor Retry-After; otherwise they back off exponentially with full jitter.
+        GitHub calls pause until their PAT's rate-limit reset when its quota is nearly spent.
+        A `json` body is encoded with orjson rather than httpx's stdlib encoder.
+        """
+        if "json" in kwargs:
+            kwargs["content"] = orjson.dumps(kwargs.pop("json"))
+            kwargs["headers"] = {**(kwargs.get("headers") or {}), "Content-Type": "application/json"}
+        auth = (kwargs.get("headers") or {}).get("Authorization") if url.startswith("https://api.github.com") else None
+        bucket = (auth, "graphql" if url == GRAPHQL_URL else "core") if auth else None
+        for attempt in range(HTTP_RETRIES + 1):
+            if bucket:
+                await self._wait_for_rate_limit(bucket)
+            response = await self.http.request(method, url, **kwargs)
+            if bucket:
+                self._track_rate_limit(bucket, response)
+            retry_after = response.headers.get("Retry-After", "")
+            # GitHub signals primary and secondary rate limits with 403 as well as 429
+            rate_limited = response.status_code == 403 and (
+                retry_after or response.headers.get("X-RateLimit-Remaining") == "0"
+            )
+            if (response.status_code not in RETRY_STATUSES and not rate_limited) or attempt == HTTP_RETRIES:
+                return response
+            if retry_after.isdigit():
+                delay = int(retry_after)
+            elif response.headers.get("X-RateLimit-Remaining") == "0":
+                delay = max(float(response.headers.get("X-RateLimit-Reset", 0)) - time.time(), 0)
+            else:
+                delay = random.uniform(0, HTTP_BACKOFF * 2 ** attempt)
+            if delay > MAX_RETRY_WAIT:
+                logger.warning("%s %s rate limited for %.0fs, not retrying", method, self._log_url(url), delay)
+                return response
+            logger.debug("%s %s returned %d, retrying in %.1fs", method, self._log_url(url), response.status_code, delay)
+            await asyncio.sleep(delay)
+
+    def _log_url(self, url: str) -> str:
+        """Host and path of `url` without the query string or the Telegram bot token."""
+        parts = urllib.parse.urlsplit(url)
+        path = parts.path.replace(self.telegram_token, "<token>") if self.telegram_token else parts.path
+        return parts.netloc + path
 
-    def get_github_pat(self, account_key: str) -> Optional[str]:
-        env_var = f"PAT_{account_key.upper()}"
-        pat = os.getenv(env_var)
-        print(f"DEBUG: PAT for {account_key} ({env_var}): {'Found' if pat else 'Not Found'}")
-        return pat
+    def _track_rate_limit(self, bucket: Tuple[str, str], response: httpx.Response):
+        remaining = response.headers.get("X-RateLimit-Remaining")
+        if remaining is not None:
+            self._rate_limits[bucket] = (int(remaining), float(response.headers.get("X-RateLimit-Reset", 0)))
 
-    def fetch_latest_workflow_run(self, repo_url: str, pat: str) -> Optional[Dict]:
+    async def _wait_for_rate_limit(self, bucket: Tuple[str, str]):
+        remaining, reset = self._rate_limits.get(bucket, (RATE_LIMIT_FLOOR, 0.0))
+        wait = reset - time.time()
+        if remaining >= RATE_LIMIT_FLOOR or wait <= 0:
+            return
+        if wait > MAX_RETRY_WAIT:
+            logger.warning("GitHub rate limit exhausted until %s, not waiting", time.strftime("%H:%M:%S", time.gmtime(reset)))
+            return
+        # Every call in this PAT's bucket waits for the same reset; the next response refreshes the numbers
+        logger.warning("GitHub rate limit nearly exhausted, waiting %.0fs for reset", wait)
+        await asyncio.sleep(wait)
+
+    async def fetch_latest_workflow_run(self, bot: Bot) -> Optional[Dict]:
+        repo_url = bot.repo
+        repo_path = bot.owner_repo
         try:
-            repo_path = repo_url.replace("https://github.com/", "").replace(".git", "").strip("/")
-            api_url = f"https://api.github.com/repos/{repo_path}/actions/runs?per_page=1"
-            headers = {
-                "Authorization": f"token {pat}",
-                "Accept": "application/vnd.github.v3+json",
-                "User-Agent": "Supervisor-Bot"
-            }
-            print(f"DEBUG: Fetching workflow for {repo_path}...")
-            response = requests.get(f"{api_url}&nocache={time.time()}", headers=headers, timeout=15)
+            headers = bot.headers
+            cached = self.etag_cache.get(repo_url)
+            if cached and len(cached) > 2 and time.time() < cached[2]:
+                # GitHub asked us (X-Poll-Interval) not to poll again yet
+                return cached[1]
+            if cached:
+                # A 304 reply is free: it does not count against the rate limit
+                headers = {**headers, "If-None-Match": cached[0]}
+            logger.debug("Fetching workflow for %s...", repo_path)
+            response = await self._request("GET", bot.runs_url, headers=headers)
+            not_before = time.time() + int(response.headers.get("X-Poll-Interval", 0))
+            if response.status_code == 304 and cached:
+                logger.debug("No changes for %s.", repo_path)
+                self.etag_cache[repo_url] = [cached[0], cached[1], not_before]
+                return cached[1]
             if response.status_code == 200:
-                runs = response.json().get("workflow_runs", [])
-                print(f"DEBUG: Found {len(runs)} runs for {repo_path}.")
-                return runs[0] if runs else None
+                runs = orjson.loads(response.content).get("workflow_runs", [])
+                logger.debug("Found %d runs for %s.", len(runs), repo_path)
+                run = runs[0] if runs else None
+                if response.headers.get("ETag"):
+                    self.etag_cache[repo_url] = [response.headers["ETag"], run, not_before]
+                return run
             else:
-                print(f"DEBUG: GitHub API Error for {repo_path}: {response.status_code} - {response.text}")
+                logger.warning("GitHub API Error for %s: %s - %s", repo_path, response.status_code, response.text)
         except Exception as e:
-            print(f"DEBUG: Exception fetching workflow for {repo_url}: {e}")
+            logger.warning("Exception fetching workflow for %s: %s", repo_url, e)
         return None
 
-    def send_telegram_message(self, text: str, chat_id: str = None):
+    async def _fetch_runs_graphql(self, bots: List[Bot]) -> Dict[str, Dict]:
+        """Fetches the latest Actions run of up to GRAPHQL_BATCH_SIZE repos in one request.
+
+        Repos GraphQL could not answer are left out so the caller can fall back to REST.
+        """
+        aliases = {}
+        fields = []
+        for i, bot in enumerate(bots):
+            owner, _, name = bot.owner_repo.partition("/")
+            aliases[f"r{i}"] = bot.repo
+            fields.append(f"r{i}: repository(owner: {orjson.dumps(owner).decode()}, name: {orjson.dumps(name).decode()}) {{ ...LatestRun }}")
+        query = "query {\n" + "\n".join(fields) + "\n}\n" + LATEST_RUN_FRAGMENT
+        runs = {}
+        try:
+            logger.debug("Fetching workflows for %d repos via GraphQL...", len(bots))
+            response = await self._request("POST", GRAPHQL_URL, json={"query": query}, headers=bots[0].headers)
+            if response.status_code != 200:
+                logger.warning("GraphQL Error: %s - %s", response.status_code, response.text)
+                return runs
+            body = orjson.loads(response.content)
+            if body.get("errors"):
+                logger.warning("GraphQL returned errors: %s", body["errors"])
+            for alias, repo in (body.get("data") or {}).items():
+                target = ((repo or {}).get("defaultBranchRef") or {}).get("target") or {}
+                suites = (target.get("checkSuites") or {}).get("nodes") or []
+                workflow_run = suites[-1].get("workflowRun") if suites else None
+                if not workflow_run:
+                    # No suite, or one without a run behind it: let REST answer for this repo
+                    continue
+                suite = suites[-1]
+                runs[aliases[alias]] = {
+                    "id": workflow_run.get("databaseId"),
+                    "status": (suite.get("status") or "").lower(),
+                    "conclusion": (suite.get("conclusion") or "").lower() or None,
+                    # Matches REST display_title for scheduled and dispatched runs
+                    "display_title": (workflow_run.get("workflow") or {}).get("name") or "Error",
+                }
+        except Exception as e:
+            logger.warning("Exception fetching workflows via GraphQL: %s", e)
+        return runs
+
+    async def fetch_all_latest_runs(self, bots: List[Bot]) -> Dict[str, Optional[Dict]]:
+        """Returns {repo_url: latest run} using one GraphQL request per PAT and batch."""
+        # Authorization -> {repo_url: bot}, so bots sharing a repo are fetched once
+        groups: Dict[str, Dict[str, Bot]] = {}
+        for bot in bots:
+            groups.setdefault(bot.headers["Authorization"], {}).setdefault(bot.repo, bot)
+        batches = [
+            (pat, list(repos.values())[i:i + GRAPHQL_BATCH_SIZE])
+            for pat, repos in groups.items()
+            for i in range(0, len(repos), GRAPHQL_BATCH_SIZE)
+        ]
+        runs = {}
+        for batch_runs in await asyncio.gather(*[self._fetch_runs_graphql(batch) for _, batch in batches]):
+            runs.update(batch_runs)
+
+        # Fall back to one REST call per repo only for what GraphQL could not answer
+        missing = [bot for _, batch in batches for bot in batch if bot.repo not in runs]
+        if missing:
+            fallback = await asyncio.gather(*[self.fetch_latest_workflow_run(bot) for bot in missing])
+            runs.update(zip([bot.repo for bot in missing], fallback))
+            self.save_etag_cache()
+        return runs
+
+    async def send_telegram_message(self, text: str, chat_id: str = None):
         target_id = chat_id or self.telegram_chat_id
         if not self.telegram_token or not target_id:
-            print(f"DEBUG: Telegram not configured. Token: {bool(self.telegram_token)}, Target ID: {target_id}")
+            logger.warning("Telegram not configured. Token: %s, Target ID: %s", bool(self.telegram_token), target_id)
             return
-        url = f"https://api.telegram.org/bot{self.telegram_token}/sendMessage"
-        print(f"DEBUG: Sending Telegram message to {target_id}...")
+        url = f"{self.telegram_api}/sendMessage"
+        chunks = split_message(text)
+        logger.debug("Sending Telegram message to %s in %d part(s)...", target_id, len(chunks))
+        try:
+            # Chunks go out in order on the pooled connection; only the last one notifies
+            for i, chunk in enumerate(chunks):
+                payload = {"chat_id": target_id, "text": chunk, "disable_notification": i < len(chunks) - 1}
+                resp = await self._request("POST", url, json=payload)
+                logger.debug("Telegram response: %s - %s", resp.status_code, resp.text)
+        except Exception as e:
+            logger.warning("Exception sending Telegram message: %s", e)
+
+    async def analyze_with_gemini(self, failures: List[str]) -> Dict[str, FixResult]:
+        """Maps each failure title to a FixResult whose fix is one of FIX_LABELS.
+
+        Titles no CLASSIFIER rule matches and the analysis cache has not seen are sent
+        to the LLM together in a single request.
+        """
+        fixes = {}
+        unclassified = []
+        for error_context in failures:
+            result = next(
+                (FixResult(fix, RULE_CONFIDENCE, f"rule:{pattern.pattern}")
+                 for pattern, fix in CLASSIFIER if pattern.search(error_context)),
+                None
+            )
+            result = result or self.get_cached_fix(_analysis_key(error_context))
+            if result:
+                fixes[error_context] = result
+            else:
+                unclassified.append(error_context)
+        if not unclassified:
+            return fixes
+        try:
+            payload = {"failures": [{"id": str(i), "ctx": ctx} for i, ctx in enumerate(unclassified)]}
+            response = await self._openai.chat.completions.create(
+                model="gpt-4.1-mini",
+                temperature=0,
+                response_format={"type": "json_object"},
+                messages=[{"role": "system", "content": ANALYSIS_PROMPT}, {"role": "user", "content": orjson.dumps(payload).decode()}]
+            )
+            labels = orjson.loads(response.choices[0].message.content).get("fixes")
+        except Exception as e:
+            logger.warning("Exception analyzing failures: %s", e)
+            labels = None
+        if not isinstance(labels, dict):
+            labels = {}
+        # Only answers the LLM actually gave are cached; missing or invalid ids get retried next run
+        answered = {}
+        for i, error_context in enumerate(unclassified):
+            result = _fix_result(labels.get(str(i)))
+            fixes[error_context] = result
+            if result is not UNCLASSIFIED:
+                answered[_analysis_key(error_context)] = result
+        if answered:
+            self.cache_fixes(answered)
+        return fixes
+
+    async def apply_fix(self, bot: Bot, run_id: int) -> bool:
+        """Re-runs the failed jobs of a run; returns whether GitHub accepted the request."""
         try:
-            resp = requests.post(url, json={"chat_id": target_id, "text": text}, timeout=15)
-            print(f"DEBUG: Telegram response: {resp.status_code} - {resp.text}")
+            response = await self._request("POST", bot.rerun_url_tmpl.format(run_id=run_id), headers=bot.headers)
+            if response.status_code == 201:
+                return True
+            logger.warning("Rerun failed for %s run %s: %s - %s", bot.owner_repo, run_id, response.status_code, response.text)
         except Exception as e:
-            print(f"DEBUG: Exception sending Telegram message: {e}")
+            logger.warning("Exception re-running %s run %s: %s", bot.owner_repo, run_id, e)
+        return False
+
+    def _check_bot(self, bot: Bot, run: Optional[Dict], fix: Optional[str] = None, fixed: bool = False) -> Tuple[str, bool]:
+        """Returns the report block for one bot and whether it needs manual action."""
+        name, channel = bot.name, bot.channel
+
+        if not bot.headers:
+            return FAILED_TMPL.format(name=name, channel=channel, error="Missing PAT"), True
+
+        if not run:
+            return OK_TMPL.format(name=name, channel=channel, notes="No recent runs"), False
+
+        status = run.get("conclusion")
+        if status is None:
+            # Queued or still running; judge it once it has a conclusion
+            return PENDING_TMPL.format(name=name, channel=channel, status=run.get("status") or "pending"), False
+        if status == "success":
+            return OK_TMPL.format(name=name, channel=channel, notes="Ran normally"), False
+        error_msg = run.get("display_title", "Error")
+        lines = FAILED_TMPL.format(name=name, channel=channel, error=error_msg)
+        if fix and fix != "none":
+            lines += FIX_LINE.format(fix=fix)
+        if fixed:
+            return lines + AUTO_FIX_LINE, False
+        return lines, True
 
-    def run_monitoring(self, chat_id: str = None):
-        print("DEBUG: Starting monitoring run...")
-        now = datetime.datetime.now()
+    async def run_monitoring(self, chat_id: str = None, repos: Optional[set] = None, only_problems: bool = False):
+        """Checks every bot, or only those whose lowercased owner/repo is in `repos`, and sends the report.
+
+        With `only_problems`, nothing is sent unless a run failed or was auto-fixed.
+        """
+        logger.info("Starting monitoring run...")
+        # One UTC instant for the whole report; avoids local tz conversion and matches the "UTC" label
+        now = datetime.datetime.now(datetime.timezone.utc)
         current_date_str = now.strftime("%d %b %Y")
         current_time_str = now.strftime("%H:%M:%S")
         unique_run_id = str(uuid.uuid4())[:8]
         
-        report = [f"📊 Daily Supervisor Report – {current_date_str}"]
+        report = io.StringIO()
+        report.write(f"📊 Daily Supervisor Report – {current_date_str}\n")
         
         manual_actions = 0
-        auto_fixes = 0
         
-        for bot in self.config.get("bots", []):
-            name = bot.get("name")
-            repo = bot.get("repo_url")
-            acc = bot.get("account")
-            channel = bot.get("channel")
-            
-            pat = self.get_github_pat(acc)
-            if not pat:
-                report.append(f"🔴 {name} ({channel})\n   ❌ Status: Failed\n   ⚠ Error: Missing PAT")
+        selected = [
+            b for b in self.config.get("bots", [])
+            if repos is None or ("_error" not in b and b["_owner_repo"].lower() in repos)
+        ]
+        bots = [
+            Bot(b.get("name"), b["repo_url"], b.get("account"), b.get("channel"),
+                b["_owner_repo"], b["_runs_url"], b["_rerun_url_tmpl"], b["_headers"])
+            for b in selected if "_error" not in b
+        ]
+        # Bots without a PAT are reported as such below and never reach the HTTP fan-out
+        viable = [bot for bot in bots if bot.headers]
+        runs = await self.fetch_all_latest_runs(viable) if viable else {}
+
+        # Triage each distinct failure once
+        failed_runs = {
+            repo_url: run for repo_url, run in runs.items()
+            if run and run.get("conclusion") not in (None, "success")
+        }
+        failures = {run.get("display_title", "Error") for run in failed_runs.values()}
+        fixes = await self.analyze_with_gemini(sorted(failures))
+
+        # Re-run every fixable failed run once, all reruns in flight together
+        fix_tasks = {}
+        for bot in bots:
+            run = failed_runs.get(bot.repo) if bot.headers else None
+            analysis = fixes.get(run.get("display_title", "Error")) if run else None
+            if (run and run.get("id") and analysis and analysis.fix in SAFE_FIXES
+                    and analysis.confidence >= AUTO_FIX_MIN_CONFIDENCE):
+                fix_tasks.setdefault((bot.owner_repo, run["id"]), bot)
+        claimed = self.reserve_fixes([run_id for _, run_id in fix_tasks])
+        fix_tasks = {key: bot for key, bot in fix_tasks.items() if key[1] in claimed}
+        results = await asyncio.gather(*[self.apply_fix(bot, run_id) for (_, run_id), bot in fix_tasks.items()])
+        applied = {key for key, ok in zip(fix_tasks, results) if ok}
+        self.release_fixes([run_id for (_, run_id), ok in zip(fix_tasks, results) if not ok])
+        auto_fixes = len(applied)
+
+        for bot in bots:
+            run = runs.get(bot.repo)
+            fix = fixes.get(run.get("display_title", "Error"), UNCLASSIFIED).fix if run else None
+            fixed = bool(run) and (bot.owner_repo, run.get("id")) in applied
+            lines, needs_action = self._check_bot(bot, run, fix, fixed)
+            report.write(lines)
+            report.write("\n")
+            if needs_action:
                 manual_actions += 1
-                continue
-            
-            run = self.fetch_latest_workflow_run(repo, pat)
-            if not run:
-                report.append(f"🟢 {name} ({channel})\n   ✔ Status: Success\n   ℹ Notes: No recent runs")
-                continue
-            
-            status = run.get("conclusion")
-            if status == "success":
-                report.append(f"🟢 {name} ({channel})\n   ✔ Status: Success\n   ℹ Notes: Ran normally")
-            else:
-                error_msg = run.get("display_title", "Error")
-                report.append(f"🔴 {name} ({channel})\n   ❌ Status: Failed\n   ⚠ Error: {error_msg}")
+        for b in selected:
+            if "_error" in b:
+                report.write(FAILED_TMPL.format(name=b.get("name"), channel=b.get("channel"), error=b["_error"]))
+                report.write("\n")
                 manual_actions += 1
 
-        report.append(f"\n🚨 Manual Action Required: {manual_actions}")
-        report.append(f"⚙ Auto-Fixes Applied Today: {auto_fixes}")
-        report.append(f"System Status: {'HEALTHY ✅' if manual_actions == 0 else 'ATTENTION ⚠️'}")
-        report.append(f"\n🕒 Last Updated: {current_time_str} UTC")
-        report.append(f"🆔 Run ID: {unique_run_id}")
+        report.write(f"\n🚨 Manual Action Required: {manual_actions}\n")
+        # Reruns from earlier scheduled runs today count too, not just this run's
+        midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        report.write(f"⚙ Auto-Fixes Applied Today: {self.count_fixes_since(int(midnight.timestamp()))}\n")
+        report.write(f"System Status: {'HEALTHY ✅' if manual_actions == 0 else 'ATTENTION ⚠️'}\n")
+        report.write(f"\n🕒 Last Updated: {current_time_str} UTC\n")
+        report.write(f"🆔 Run ID: {unique_run_id}")
+
+        if only_problems and not manual_actions and not auto_fixes:
+            logger.info("All checked bots are healthy; no report sent.")
+            return
         
-        self.send_telegram_message("\n".join(report), chat_id)
+        await self.send_telegram_message(report.getvalue(), chat_id)
+
+    @functools.cached_property
+    def _bots_context(self) -> str:
+        """Bots JSON for the chat prompt, built once and reset when a bot is added.
+
+        Sorted and without the _ keys, which are derived and include the PAT headers.
+        """
+        bots = sorted(
+            ({k: v for k, v in b.items() if not k.startswith("_")} for b in self.config.get("bots", [])),
+            key=lambda b: str(b.get("repo_url", "")),
+        )
+        return f"Bots: {orjson.dumps(bots, option=orjson.OPT_SORT_KEYS).decode()}"
 
-    def ai_chat(self, user_message: str) -> str:
+    async def ai_chat(self, user_message: str) -> str:
         try:
-            now = datetime.datetime.now()
-            sys_prompt = f"You are Shisui, a smart assistant. Today is {now.strftime('%d %b %Y %H:%M:%S')}. Help the user with their bots: {json.dumps(self.config.get('bots', []))}"
-            response = client.chat.completions.create(
+            now = datetime.datetime.now(datetime.timezone.utc)
+            # Both system messages are identical across calls so the provider can cache the
+            # prefix; only the trailing user turns change
+            response = await self._openai.chat.completions.create(
                 model="gpt-4.1-mini",
-                messages=[{"role": "system", "content": sys_prompt}, {"role": "user", "content": user_message}]
+                messages=[
+                    {"role": "system", "content": SYSTEM_HEADER},
+                    {"role": "system", "content": self._bots_context},
+                    {"role": "user", "content": f"Today is {now.strftime('%d %b %Y %H:%M:%S')} UTC."},
+                    {"role": "user", "content": user_message}
+                ]
             )
             return response.choices[0].message.content
         except Exception as e:
             return f"Error: {e}"
 
-    def process_updates(self):
-        if not self.telegram_token: return
-        url = f"https://api.telegram.org/bot{self.telegram_token}/getUpdates"
-        params = {"offset": self.last_update_id + 1, "timeout": 20}
+    def handle_add_bot(self, text: str) -> str:
+        """Adds the bot described by 'Add new Telegram bot: URL, ACC, CHANNEL' and saves apps.yaml.
+
+        Runs without awaiting, so concurrent update handlers cannot interleave an add.
+        """
+        usage = f"⚠ Usage: {ADD_BOT_PREFIX} https://github.com/OWNER/REPO, ACCOUNT, @CHANNEL"
+        m = _ADD_RE.match(text)
+        if not m:
+            return usage
+        repo_url, account, channel = m.group("url", "acc", "channel")
+        bot = {"repo_url": repo_url, "account": account, "channel": channel, "type": "telegram"}
+        try:
+            self._prepare_bot(bot)
+        except ValueError:
+            # The regex lets through URLs such as .../OWNER// that have no usable repo part
+            return usage
+        key = bot["_owner_repo"].lower()
+        if key in self._bots_by_repo:
+            return f"ℹ {self._bots_by_repo[key]['repo_url']} is already monitored."
+        bot["name"] = bot["_owner_repo"].split("/")[1]
+        self.config.setdefault("bots", []).append(bot)
+        self._bots_by_repo[key] = bot
+        self.__dict__.pop("_bots_context", None)
+        self.save_config()
+        return f"✅ New bot added: {bot['name']} ({channel})"
+
+    async def process_updates(self) -> bool:
+        """Long-polls getUpdates once and handles the batch; returns False if the poll itself failed."""
+        if not self.telegram_token: return False
+        url = f"{self.telegram_api}/getUpdates"
+        # Long poll: Telegram holds the request open until an update arrives or 50s pass
+        params = {"offset": self.last_update_id + 1, "timeout": 50, "allowed_updates": '["message"]'}
         try:
-            resp = requests.get(url, params=params, timeout=25).json()
+            resp = orjson.loads((await self._request("GET", url, params=params, timeout=55)).content)
             if not resp.get("ok"): 
-                print(f"DEBUG: Telegram getUpdates error: {resp}")
-                return
-            for update in resp.get("result", []):
-                self.last_update_id = update["update_id"]
-                msg = update.get("message", {})
-                text = msg.get("text", "")
-                cid = msg.get("chat", {}).get("id")
-                print(f"DEBUG: Received message: '{text}' from {cid}")
+                logger.warning("Telegram getUpdates error: %s", resp)
+                return False
+            updates = resp.get("result", [])
+            if not updates:
+                return True
+            self.last_update_id = max(u["update_id"] for u in updates)
+            self.save_update_offset()
+            task = asyncio.create_task(self._handle_batch(updates))
+            self._update_tasks.add(task)
+            task.add_done_callback(self._update_tasks.discard)
+        except Exception as e: 
+            logger.warning("Exception in process_updates: %s", e)
+            return False
+        return True
+
+    async def _handle_batch(self, updates: List[Dict]):
+        """Handles one getUpdates batch concurrently, then sends one combined reply per chat.
+
+        Replies keep the order of the messages they answer; different chats are sent in parallel.
+        """
+        replies = await asyncio.gather(*[self._handle_update(update) for update in updates])
+        by_chat: Dict[Any, List[str]] = {}
+        for reply in replies:
+            if reply:
+                by_chat.setdefault(reply[0], []).append(reply[1])
+        await asyncio.gather(*[self.send_telegram_message("\n\n".join(texts), cid) for cid, texts in by_chat.items()])
+
+    async def _handle_update(self, update: Dict) -> Optional[Tuple[Any, str]]:
+        """Handles one message and returns its (chat_id, reply), if it needs one."""
+        msg = update.get("message", {})
+        text = msg.get("text", "")
+        cid = msg.get("chat", {}).get("id")
+        logger.debug("Received message: '%s' from %s", text, cid)
+        async with self._update_slots:
+            try:
                 if text.lower() == "/status":
-                    self.run_monitoring(cid)
+                    await self.run_monitoring(cid)
+                elif text.startswith(ADD_BOT_PREFIX):
+                    # Added repos run with a configured PAT, so only the report chat may add them
+                    if str(cid) != self.telegram_chat_id:
+                        logger.warning("Refused add-bot command from chat %s", cid)
+                        return cid, "⛔ Only the supervisor's own chat can add bots."
+                    return cid, self.handle_add_bot(text)
                 elif text:
-                    self.send_telegram_message(self.ai_chat(text), cid)
-        except Exception as e: 
-            print(f"DEBUG: Exception in process_updates: {e}")
+                    return cid, await self.ai_chat(text)
+            except Exception as e:
+                logger.warning("Exception handling update %s: %s", update.get("update_id"), e)
 
-if __name__ == "__main__":
+    async def drain_updates(self):
+        """Waits for updates still being handled, e.g. before shutting down."""
+        if self._update_tasks:
+            await asyncio.gather(*self._update_tasks)
+
+async def main():
     bot = SupervisorBot()
     event = os.getenv("GITHUB_EVENT_NAME")
-    print(f"DEBUG: Event name: {event}")
-    if event in ["schedule", "workflow_dispatch"]:
-        bot.run_monitoring()
-    else:
-        # Polling mode for 10 minutes
-        print("DEBUG: Entering polling mode...")
-        start = time.time()
-        while time.time() - start < 600:
-            bot.process_updates()
-            time.sleep(5)
+    logger.info("Event name: %s", event)
+    try:
+        if event in ["schedule", "workflow_dispatch"]:
+            await bot.run_monitoring()
+        elif event == "repository_dispatch":
+            # Sent by a monitored repo when its workflow run completes; triage just that repo
+            # and only message the chat if it needs attention
+            event_path = os.environ.get("GITHUB_EVENT_PATH")
+            if not event_path:
+                logger.error("repository_dispatch without GITHUB_EVENT_PATH; cannot tell which repo to check")
+                return
+            with open(event_path, "rb") as f:
+                payload = orjson.loads(f.read()).get("client_payload") or {}
+            repo_url = payload.get("repo_url")
+            try:
+                key = _repo_key(repo_url)
+            except (ValueError, TypeError, AttributeError):
+                key = None
+            if key in bot._bots_by_repo:
+                await bot.run_monitoring(repos={key}, only_problems=True)
+            else:
+                logger.warning("Ignoring dispatch for unmonitored repo %s", repo_url)
+        else:
+            # Polling mode for 10 minutes
+            logger.info("Entering polling mode...")
+            start = time.time()
+            failed_polls = 0
+            while time.time() - start < 600:
+                # The long poll itself waits for messages; only back off after failed polls,
+                # exponentially with jitter so a Telegram outage is not hammered
+                if await bot.process_updates():
+                    failed_polls = 0
+                else:
+                    failed_polls += 1
+                    await asyncio.sleep(min(2 ** failed_polls, POLL_BACKOFF_MAX) + random.random())
+            await bot.drain_updates()
+    finally:
+        await bot.http.aclose()
+        await bot.close_openai()
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=os.getenv("SUPERVISOR_LOG_LEVEL", "INFO").upper(),
+        format="%(asctime)s %(levelname)s %(message)s",
+    )
+    # httpx logs every request URL at INFO, and Telegram URLs embed the bot token
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    asyncio.run(main())